@@ -0,0 +1,176 @@
+import numpy as np
+
+
+def frame_edges(frame_timestamp):
+    """
+    edges of the time bins covered by each imaging frame
+
+    frame i covers [frame_timestamp[i], frame_timestamp[i+1]). The last frame
+    is assumed to last as long as the median frame interval.
+    """
+    frame_timestamp = np.asarray(frame_timestamp, dtype=float)
+
+    if len(frame_timestamp) > 1:
+        last = frame_timestamp[-1] + np.median(np.diff(frame_timestamp))
+    else:
+        last = np.inf
+
+    return np.append(frame_timestamp, last)
+
+
+def frame_bounds(timestamp, frame_timestamp):
+    """
+    sample index range belonging to each imaging frame
+
+    Input :
+    timestamp : sorted timestamps of the behaviour samples
+    frame_timestamp : sorted timestamps of the imaging frames
+
+    Output :
+    array of length nframes+1; samples bounds[i]:bounds[i+1] fall in frame i
+    """
+    return np.searchsorted(timestamp, frame_edges(frame_timestamp), side='left')
+
+
+def bin_to_frames(data, timestamp, frame_timestamp, method='mean'):
+    """
+    resample high rate channels onto the imaging frame clock in one pass
+
+    Input :
+    data : 1D signal, or 2D array of shape (channels, samples)
+    timestamp : sorted timestamps of the samples in data
+    frame_timestamp : sorted timestamps of the imaging frames
+    method : 'mean', 'max', 'min' or 'sum' of the samples within each frame,
+             or 'count' for the number of samples within each frame
+
+    Output :
+    array of shape (frames,) or (channels, frames). Frames without any
+    samples are nan for 'mean', 'max' and 'min' and 0 for 'sum' and 'count'.
+    A nan sample makes the 'mean' and 'sum' of its own frame nan and is
+    ignored by 'max' and 'min'
+    """
+    data = np.asarray(data, dtype=float)
+    bounds = frame_bounds(timestamp, frame_timestamp)
+    counts = np.diff(bounds)
+    empty = counts == 0
+
+    if method == 'count':
+        return np.broadcast_to(counts, data.shape[:-1]+counts.shape).copy()
+
+    if method in ('mean', 'sum'):
+        ufunc, fill, pad = np.add, 0., 0.
+    elif method in ('max', 'min'):
+        ufunc = np.fmax if method == 'max' else np.fmin
+        fill, pad = np.nan, np.nan
+    else:
+        raise ValueError("method should be 'mean', 'max', 'min', 'sum' or 'count'")
+
+    binned = np.full(data.shape[:-1]+counts.shape, fill)
+    if np.any(~empty):
+        # interleave frame starts and ends so that every even segment of
+        # reduceat is exactly one frame, keeping a nan within its own frame;
+        # the pad keeps the final end index valid and does not change the result
+        padded = np.concatenate((data, np.full(data.shape[:-1]+(1,), pad)), axis=-1)
+        idx = np.column_stack((bounds[:-1][~empty], bounds[1:][~empty])).ravel()
+        binned[..., ~empty] = ufunc.reduceat(padded, idx, axis=-1)[..., ::2]
+
+    if method == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            binned = binned/counts
+
+    return binned
+
+
+def bout_count_per_frame(bout_index, timestamp, frame_timestamp):
+    """
+    number of bouts starting within each imaging frame
+
+    bout_index : (start, end) indices as returned by bout_detect
+    """
+    start_time = np.asarray(timestamp)[np.asarray(bout_index[0], dtype=int)]
+    edges = frame_edges(frame_timestamp)
+    nframes = len(edges)-1
+
+    frame = np.searchsorted(edges, start_time, side='right')-1
+    frame = frame[(frame >= 0) & (frame < nframes)]
+
+    return np.bincount(frame, minlength=nframes)
+
+
+def frames_to_timestamp(traces, frame_timestamp, timestamp):
+    """
+    linearly interpolate imaging traces onto the behaviour timestamps
+
+    Input :
+    traces : 1D trace, or 2D array of shape (cells, frames)
+    frame_timestamp : sorted timestamps of the imaging frames
+    timestamp : timestamps to interpolate onto
+
+    Output :
+    array of shape (samples,) or (cells, samples). Values outside the imaging
+    period are held at the first / last frame, as in np.interp
+    """
+    traces = np.asarray(traces, dtype=float)
+    frame_timestamp = np.asarray(frame_timestamp, dtype=float)
+    timestamp = np.asarray(timestamp, dtype=float)
+
+    if len(frame_timestamp) == 1:
+        return np.repeat(traces, len(timestamp), axis=-1)
+
+    t = np.clip(timestamp, frame_timestamp[0], frame_timestamp[-1])
+    right = np.clip(np.searchsorted(frame_timestamp, t, side='right'), 1, len(frame_timestamp)-1)
+    left = right-1
+
+    w = (t-frame_timestamp[left])/(frame_timestamp[right]-frame_timestamp[left])
+
+    return traces[..., left]*(1-w) + traces[..., right]*w
+
+
+def trigger_frames(trigger_times, frame_timestamp, mode=None):
+    """
+    vectorized equivalent of utils.get_trigger_frames_from_trigger_times
+
+    mode 'nearest' returns the closest frame, otherwise the first frame at or
+    after each trigger
+    """
+    frame_timestamp = np.asarray(frame_timestamp)
+    trigger_times = np.asarray(trigger_times)
+
+    after = np.searchsorted(frame_timestamp, trigger_times, side='left')
+
+    if mode != 'nearest':
+        return after
+
+    before = np.clip(after-1, 0, len(frame_timestamp)-1)
+    after_c = np.clip(after, 0, len(frame_timestamp)-1)
+    d_before = np.abs(frame_timestamp[before]-trigger_times)
+    d_after = np.abs(frame_timestamp[after_c]-trigger_times)
+
+    return np.where(d_after < d_before, after_c, before)
+
+
+def trigger_windows(traces, trig_indices, trig_range, nframes=None):
+    """
+    crop all traces around all triggers in one indexing step
+
+    Input :
+    traces : 1D trace, or 2D array of shape (cells, frames)
+    trig_indices : frame indices of the triggers
+    trig_range : (before, after) frame offsets relative to each trigger
+    nframes : number of frames, defaults to the length of the traces
+
+    Output :
+    array of shape (cells, trials, time) or (trials, time). As in
+    utils.triggered_response, triggers whose window does not fit are dropped
+    """
+    traces = np.asarray(traces)
+    trig_indices = np.asarray(trig_indices, dtype=int)
+
+    if nframes is None:
+        nframes = traces.shape[-1]
+
+    valid = (trig_indices+trig_range[0] >= 0) & (trig_indices+trig_range[1] <= nframes)
+    offsets = np.arange(trig_range[0], trig_range[1])
+    idx = trig_indices[valid][:, None] + offsets[None, :]
+
+    return traces[..., idx]
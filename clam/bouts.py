@@ -1,5 +1,7 @@
 import numpy as np
 import math
+import collections
+import concurrent.futures
 import scipy.integrate
 
 
@@ -73,6 +75,189 @@ def bout_detect(data,min_thresh=0.05,max_thresh=0.15,min_spacing=7):
     return(s,e)
 
 
+def _bout_candidates(block,min_thresh,min_spacing):
+    """
+    indices in 'block' where bout_detect could start or end a bout
+
+    Only indices that are followed by at least 'min_spacing' samples within
+    the block are tested, so consecutive blocks must overlap by 'min_spacing'.
+    Returned end candidates are the last supra-threshold sample of a bout.
+    """
+
+    block=np.asarray(block)
+    n=len(block)-min_spacing
+    if n<=0:
+        return np.array([],dtype=int),np.array([],dtype=int)
+
+    below=block<min_thresh
+    above=block>=min_thresh
+
+    rises=np.where(below[:n]&above[1:n+1])[0]
+
+    # number of sub-threshold samples in block[i+1:i+min_spacing]
+    quiet=np.concatenate(([0],np.cumsum(below)))
+    quiet=quiet[min_spacing:min_spacing+n]-quiet[1:n+1]
+    falls=np.where(above[:n]&(quiet==min_spacing-1))[0]
+
+    return rises,falls
+
+
+def _pair_bouts(rises,falls,open_start=None):
+    """
+    alternate start and end candidates the way the bout_detect loop does
+
+    'open_start' is the start of a bout that is still running from a previous
+    call. Returns the bout starts and ends; if the last bout is still running
+    there is one more start than ends.
+    """
+
+    events=np.concatenate((rises,falls)).astype(int)
+    kind=np.concatenate((np.zeros(len(rises),dtype=int),np.ones(len(falls),dtype=int)))
+    order=np.argsort(events,kind='stable')
+    events=events[order]
+    kind=kind[order]
+
+    # only the first candidate of each run of the same kind toggles the state
+    keep=np.ones(len(events),dtype=bool)
+    keep[1:]=kind[1:]!=kind[:-1]
+    if len(events)>0:
+        keep[0]=kind[0]!=(1 if open_start is None else 0)
+
+    start=events[keep&(kind==0)]
+    end=events[keep&(kind==1)]+1
+
+    if open_start is not None:
+        start=np.concatenate(([open_start],start)).astype(int)
+
+    return start,end
+
+
+def _trim_bouts(start,end,n,min_spacing):
+    """
+    drop incomplete bouts as bout_detect does; None if no bout was found
+    """
+
+    if len(start)==0 or len(end)==0:
+        return None
+
+    start=start[0:len(end)]
+
+    if end[-1]==n-min_spacing:
+        start=start[:-1]
+        end=end[:-1]
+
+    return start,end
+
+
+def _bout_peaks(block,start,end):
+    """maximum of block[start[i]:end[i]] for every bout"""
+
+    if len(start)==0:
+        return np.array([])
+
+    block=np.append(np.asarray(block,dtype=float),np.nan)
+    idx=np.column_stack((start,end)).ravel()
+
+    return np.fmax.reduceat(block,idx)[::2]
+
+
+def _block_candidates(block,offset,min_thresh,min_spacing):
+
+    rises,falls=_bout_candidates(block,min_thresh,min_spacing)
+    return rises+offset,falls+offset
+
+
+def _block_peaks(block,offset,start,end):
+
+    return _bout_peaks(block,start-offset,end-offset)
+
+
+def _bounded_map(pool,func,tasks,workers):
+    """
+    run tasks on the pool in order, with at most 'workers' of them pending
+    so that only that many blocks are held in memory at once
+    """
+
+    pending=collections.deque()
+    for args in tasks:
+        pending.append(pool.submit(func,*args))
+        if len(pending)>=workers:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def bout_detect_chunked(data,min_thresh=0.05,max_thresh=0.15,min_spacing=7,
+                        block_size=2**20,workers=4,executor='thread'):
+    """
+    block-wise bout_detect for recordings that do not fit in memory
+
+    Input :
+    data : 1D signal, may be a memory-mapped array (eg: np.load(f,mmap_mode='r'))
+    min_thresh, max_thresh, min_spacing : as in bout_detect
+    block_size : number of samples handed to a worker at once
+    workers : number of blocks processed in parallel
+    executor : 'thread' or 'process'
+
+    Output :
+    indices of start and end of each bout, identical to bout_detect(data,...)
+
+    Blocks overlap by 'min_spacing' samples, which is all the look-ahead the
+    threshold crossings need. Bouts that cross block boundaries are stitched
+    by pairing the crossings of all blocks together. Peak memory is about
+    block_size x workers samples.
+    """
+
+    if executor=='thread':
+        pool_type=concurrent.futures.ThreadPoolExecutor
+    elif executor=='process':
+        pool_type=concurrent.futures.ProcessPoolExecutor
+    else:
+        raise ValueError("executor should be 'thread' or 'process'")
+
+    n=len(data)
+    block_size=max(int(block_size),1)
+
+    def read(lo,hi):
+        # processes need their own copy of the block, threads can read the map
+        block=data[lo:hi]
+        return np.array(block) if executor=='process' else block
+
+    with pool_type(max_workers=workers) as pool:
+
+        tasks=((read(lo,min(lo+block_size,n-min_spacing)+min_spacing),lo,min_thresh,min_spacing)
+               for lo in range(2,n-min_spacing,block_size))
+        candidates=list(_bounded_map(pool,_block_candidates,tasks,workers))
+
+        if len(candidates)==0:
+            return(np.array([0]),np.array([0]))
+
+        rises=np.concatenate([c[0] for c in candidates])
+        falls=np.concatenate([c[1] for c in candidates])
+
+        bouts=_trim_bouts(*_pair_bouts(rises,falls),n=n,min_spacing=min_spacing)
+        if bouts is None:
+            return(np.array([0]),np.array([0]))
+        start,end=bouts
+
+        # group consecutive bouts into spans of about one block to find peaks
+        groups=[]
+        k=0
+        while k<len(start):
+            j=max(np.searchsorted(end,start[k]+block_size,side='right'),k+1)
+            groups.append((start[k:j],end[k:j]))
+            k=j
+
+        tasks=((read(s[0],e[-1]),s[0],s,e) for s,e in groups)
+        peaks=list(_bounded_map(pool,_block_peaks,tasks,workers))
+
+    peaks=np.concatenate(peaks) if len(peaks)>0 else np.array([])
+    passed=peaks>max_thresh
+
+    return(start[passed],end[passed])
+
+
 def bout_duration(bout_index,timestamp):
 
     start_index=np.array(bout_index[0])
@@ -96,7 +281,10 @@ def mean_bout_velocity(data,bout_index,timestamp,bout_duration):
         if end_index[i]-start_index[i]!=0:
             x=timestamp[start_index[i]:end_index[i]]
             y=data[start_index[i]:end_index[i]]
-            auc=scipy.integrate.simps(y,x=x,even='avg')
+            if hasattr(scipy.integrate,'simpson'):
+                auc=scipy.integrate.simpson(y,x=x)
+            else:
+                auc=scipy.integrate.simps(y,x=x,even='avg')
             strength.append(auc/bout_duration[i])
 
     return strength
@@ -0,0 +1,186 @@
+import numpy as np
+import concurrent.futures
+
+
+def stack_sessions(sessions, key=None):
+    """
+    pool per session values into one array with a group label per value
+
+    Input :
+    sessions : list of 1D arrays (eg: bout durations of each fish), or a list
+               of dictionaries such as bout tables, in which case 'key' picks
+               the metric to pool
+    key : entry of each dictionary to pool
+
+    Output :
+    values, group : 1D arrays; group[i] is the session index of values[i].
+                    nan values are dropped
+    """
+    if key is not None:
+        sessions = [s[key] for s in sessions]
+
+    sessions = [np.asarray(s, dtype=float).ravel() for s in sessions]
+    counts = [len(s) for s in sessions]
+
+    values = np.concatenate(sessions) if len(sessions) > 0 else np.array([])
+    group = np.repeat(np.arange(len(sessions)), counts)
+
+    valid = ~np.isnan(values)
+
+    return values[valid], group[valid]
+
+
+def _sorted_groups(values, group):
+    """values sorted within groups, with the label, offset and size of each group"""
+
+    values = np.asarray(values, dtype=float)
+    group = np.asarray(group)
+
+    order = np.lexsort((values, group))
+    values = values[order]
+    group = group[order]
+
+    labels, offsets, counts = np.unique(group, return_index=True, return_counts=True)
+
+    return values, labels, offsets, counts
+
+
+def group_summary(values, group, quantiles=(0.25, 0.5, 0.75)):
+    """
+    per group summary statistics without looping over groups
+
+    Input :
+    values, group : as returned by stack_sessions
+    quantiles : quantiles to compute, linearly interpolated as in np.quantile
+
+    Output :
+    dictionary with the group 'labels', the number of values 'n', the 'mean',
+    'median' and 'std' of each group and a (groups, quantiles) 'quantiles' array
+    """
+    values, labels, offsets, counts = _sorted_groups(values, group)
+
+    sums = np.add.reduceat(values, offsets) if len(values) > 0 else np.array([])
+    mean = sums/counts
+    sq = np.add.reduceat((values-np.repeat(mean, counts))**2, offsets) if len(values) > 0 else np.array([])
+    std = np.sqrt(sq/counts)
+
+    def quantile(q):
+        pos = q*(counts-1)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo+1, counts-1)
+        frac = pos-lo
+        return values[offsets+lo] + frac*(values[offsets+hi]-values[offsets+lo])
+
+    q = np.column_stack([quantile(qq) for qq in quantiles]) if len(quantiles) > 0 \
+        else np.empty((len(labels), 0))
+
+    return {'labels': labels, 'n': counts, 'mean': mean, 'median': quantile(0.5),
+            'std': std, 'quantiles': q}
+
+
+def group_histograms(values, group, bins):
+    """
+    histogram of every group on shared bins
+
+    Input :
+    values, group : as returned by stack_sessions
+    bins : bin edges shared by all groups
+
+    Output :
+    labels of the groups and their (groups, bins) counts. Values outside the
+    bins are ignored, the last bin includes its right edge as in np.histogram
+    """
+    values = np.asarray(values, dtype=float)
+    bins = np.asarray(bins, dtype=float)
+    nbins = len(bins)-1
+
+    labels, inverse = np.unique(group, return_inverse=True)
+
+    b = np.searchsorted(bins, values, side='right')-1
+    b[values == bins[-1]] = nbins-1
+    inside = (b >= 0) & (b < nbins)
+
+    counts = np.bincount(inverse[inside]*nbins+b[inside], minlength=len(labels)*nbins)
+
+    return labels, counts.reshape(len(labels), nbins)
+
+
+def _bootstrap_batch(values, offsets, counts, nboot, statistic, seed):
+    """
+    'nboot' hierarchical resamples: groups with replacement, then values
+    with replacement within each chosen group
+    """
+
+    rng = np.random.default_rng(seed)
+    ngroups = len(counts)
+
+    chosen = rng.integers(0, ngroups, size=nboot*ngroups)
+    n = counts[chosen]
+    draws = np.repeat(chosen, n)
+    idx = offsets[draws] + (rng.random(len(draws))*counts[draws]).astype(int)
+    sample = values[idx]
+
+    # every resample has at least one value as empty groups are not stacked
+    size = n.reshape(nboot, ngroups).sum(1)
+    bounds = np.concatenate(([0], np.cumsum(size)[:-1]))
+
+    if statistic == 'mean':
+        return np.add.reduceat(sample, bounds)/size
+
+    if statistic == 'median':
+        statistic = np.median
+
+    return np.array([statistic(s) for s in np.split(sample, bounds[1:])])
+
+
+def hierarchical_bootstrap(values, group, statistic='mean', nboot=10000, ci=95,
+                           seed=None, workers=4, executor='thread', batch_size=None):
+    """
+    confidence interval of a pooled statistic by resampling fish, then bouts
+
+    Input :
+    values, group : as returned by stack_sessions
+    statistic : 'mean', 'median' or a function of a 1D array
+    nboot : number of resamples
+    ci : width of the confidence interval in percent
+    seed : seed of the random number generator; each batch of resamples gets
+           its own independent stream, so results do not depend on 'workers'
+    workers : number of batches run in parallel
+    executor : 'thread' or 'process'
+    batch_size : resamples per batch, by default about 4 million draws
+
+    Output :
+    statistic of all values, (lower, upper) confidence interval and the
+    bootstrap distribution
+    """
+    if executor == 'thread':
+        pool_type = concurrent.futures.ThreadPoolExecutor
+    elif executor == 'process':
+        pool_type = concurrent.futures.ProcessPoolExecutor
+    else:
+        raise ValueError("executor should be 'thread' or 'process'")
+
+    values, labels, offsets, counts = _sorted_groups(values, group)
+
+    if statistic == 'mean':
+        estimate = np.mean(values)
+    elif statistic == 'median':
+        estimate = np.median(values)
+    else:
+        estimate = statistic(values)
+
+    if batch_size is None:
+        batch_size = max(1, 2**22//max(1, len(values)))
+
+    sizes = [min(batch_size, nboot-i) for i in range(0, nboot, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    with pool_type(max_workers=workers) as pool:
+        futures = [pool.submit(_bootstrap_batch, values, offsets, counts, s, statistic, ss)
+                   for s, ss in zip(sizes, seeds)]
+        samples = np.concatenate([f.result() for f in futures]) if len(futures) > 0 else np.array([])
+
+    alpha = (100-ci)/2
+    interval = tuple(np.percentile(samples, [alpha, 100-alpha])) if len(samples) > 0 else (np.nan, np.nan)
+
+    return estimate, interval, samples
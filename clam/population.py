@@ -0,0 +1,133 @@
+import numpy as np
+
+
+def response_tensor(triggered_traces):
+    """
+    convert the nested lists from utils.triggered_response into an array of
+    shape (cells, trials, time). All cells need the same number of trials
+    """
+    return np.asarray(triggered_traces)
+
+
+def response_matrix(responses, baseline=None, zscore=True, dtype=np.float64):
+    """
+    trial averaged, optionally z-scored, response of every cell
+
+    Input :
+    responses : triggered averages (cells, time) or a (cells, trials, time) tensor
+    baseline : (start, stop) frames used for the mean and stdv of the z-score,
+               the whole response if None
+    zscore : if False only the trial average is returned
+    dtype : output dtype, eg: np.float32 to halve the memory
+
+    Output :
+    array of shape (cells, time)
+    """
+    responses = np.asarray(responses)
+
+    if responses.ndim == 3:
+        mat = responses.mean(axis=1, dtype=np.float64)
+    else:
+        mat = np.array(responses, dtype=np.float64)
+
+    if zscore:
+        ref = mat if baseline is None else mat[:, baseline[0]:baseline[1]]
+        mean = ref.mean(axis=1, keepdims=True)
+        std = ref.std(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mat = (mat-mean)/std
+
+    return mat.astype(dtype, copy=False)
+
+
+def _normalized_rows(mat, dtype):
+    """rows with zero mean and unit norm, so that their dot product is r"""
+
+    mat = np.array(mat, dtype=dtype)
+    mat -= mat.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mat /= np.linalg.norm(mat, axis=1, keepdims=True)
+
+    return mat
+
+
+def _tile_rows(ncells, itemsize, memory_budget):
+    """number of rows of a (rows, ncells) tile that fit within the budget"""
+
+    return int(max(1, memory_budget // max(1, ncells*itemsize)))
+
+
+def correlation_matrix(responses, memory_budget=2**28, dtype=np.float64, out=None):
+    """
+    pairwise Pearson correlation between cells, computed in row tiles
+
+    Input :
+    responses : (cells, time) matrix, eg: from response_matrix, or a
+                (cells, trials, time) tensor which is trial averaged first
+    memory_budget : bytes used for each temporary tile
+    dtype : np.float64 or np.float32
+    out : optional (cells, cells) array to write into, eg: a np.memmap
+
+    Output :
+    (cells, cells) correlation matrix, same as np.corrcoef(responses)
+    """
+    responses = np.asarray(responses)
+    if responses.ndim == 3:
+        responses = response_matrix(responses, zscore=False)
+
+    z = _normalized_rows(responses, dtype)
+    ncells = z.shape[0]
+
+    if out is None:
+        out = np.empty((ncells, ncells), dtype=dtype)
+
+    step = _tile_rows(ncells, z.itemsize, memory_budget)
+    for i in range(0, ncells, step):
+        out[i:i+step] = np.dot(z[i:i+step], z.T)
+
+    return out
+
+
+def nearest_neighbours(responses, k=10, memory_budget=2**28, dtype=np.float64):
+    """
+    the k most correlated cells of every cell, without the full matrix
+
+    Input :
+    responses : (cells, time) matrix or (cells, trials, time) tensor
+    k : number of neighbours per cell, the cell itself is excluded
+    memory_budget : bytes used for each temporary tile
+    dtype : np.float64 or np.float32
+
+    Output :
+    indices and correlations of the neighbours, both (cells, k), sorted from
+    the most to the least correlated
+    """
+    responses = np.asarray(responses)
+    if responses.ndim == 3:
+        responses = response_matrix(responses, zscore=False)
+
+    z = _normalized_rows(responses, dtype)
+    ncells = z.shape[0]
+    k = min(k, ncells-1)
+
+    indices = np.empty((ncells, k), dtype=int)
+    values = np.empty((ncells, k), dtype=dtype)
+
+    step = _tile_rows(ncells, z.itemsize, memory_budget)
+    for i in range(0, ncells, step):
+        tile = np.dot(z[i:i+step], z.T)
+        rows = np.arange(tile.shape[0])
+        tile[rows, rows+i] = -np.inf
+        tile[np.isnan(tile)] = -np.inf
+
+        top = np.argpartition(-tile, k-1, axis=1)[:, :k] if k > 0 else np.empty((len(rows), 0), dtype=int)
+        topval = np.take_along_axis(tile, top, axis=1)
+        order = np.argsort(-topval, axis=1, kind='stable')
+
+        indices[i:i+step] = np.take_along_axis(top, order, axis=1)
+        values[i:i+step] = np.take_along_axis(topval, order, axis=1)
+
+    # undefined correlations, eg: of a flat response, were ranked last
+    values[np.isneginf(values)] = np.nan
+
+    return indices, values
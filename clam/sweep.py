@@ -0,0 +1,128 @@
+import numpy as np
+import concurrent.futures
+
+from clam.bouts import _pair_bouts, _trim_bouts, _bout_peaks
+
+
+def _sweep_min_thresh(data, timestamp, min_thresh, max_thresh, min_spacing):
+    """
+    bout_detect for one 'min_thresh' and every 'max_thresh' and 'min_spacing'
+
+    The threshold crossings are computed once and reused for every spacing,
+    and the bout peaks once per spacing and reused for every 'max_thresh'.
+    """
+
+    data = np.asarray(data)
+    n = len(data)
+
+    below = data < min_thresh
+    above = data >= min_thresh
+    quiet = np.concatenate(([0], np.cumsum(below)))
+
+    rises = np.where(below[:-1] & above[1:])[0]
+    rises = rises[rises >= 2]
+
+    # candidate bout ends for a spacing ms: above at i, below for i+1..i+ms-1
+    supra = np.where(above)[0]
+    supra = supra[supra >= 2]
+
+    count = np.zeros((len(max_thresh), len(min_spacing)), dtype=int)
+    bouts, peak, duration = {}, {}, {}
+
+    for j, ms in enumerate(min_spacing):
+
+        last = n-ms
+        r = rises[rises < last]
+        f = supra[supra < last]
+        f = f[quiet[f+ms]-quiet[f+1] == ms-1]
+
+        trimmed = _trim_bouts(*_pair_bouts(r, f), n=n, min_spacing=ms)
+
+        if trimmed is None:
+            start = end = np.array([], dtype=int)
+        else:
+            start, end = trimmed
+
+        p = _bout_peaks(data, start, end)
+
+        for i, mx in enumerate(max_thresh):
+            passed = p > mx
+            key = (min_thresh, mx, ms)
+            count[i, j] = np.count_nonzero(passed)
+            if trimmed is None:
+                # same placeholder as bout_detect when no bout is found
+                bouts[key] = (np.array([0]), np.array([0]))
+            else:
+                bouts[key] = (start[passed], end[passed])
+            peak[key] = p[passed]
+            if timestamp is not None:
+                duration[key] = timestamp[end[passed]]-timestamp[start[passed]]
+
+    return count, bouts, peak, duration
+
+
+def _merge(results, min_thresh, max_thresh, min_spacing, timestamp):
+
+    sweep = {'min_thresh': min_thresh, 'max_thresh': max_thresh, 'min_spacing': min_spacing,
+             'count': np.stack([r[0] for r in results]), 'bouts': {}, 'peak': {}}
+    if timestamp is not None:
+        sweep['duration'] = {}
+
+    for r in results:
+        sweep['bouts'].update(r[1])
+        sweep['peak'].update(r[2])
+        if timestamp is not None:
+            sweep['duration'].update(r[3])
+
+    return sweep
+
+
+def bout_detect_sweep(sessions, min_thresh, max_thresh, min_spacing, timestamps=None,
+                      workers=4, executor='thread'):
+    """
+    run bout_detect over a grid of parameters, sharing work between grid points
+
+    Input :
+    sessions : 1D signal, or a list of signals (eg: one per fish)
+    min_thresh, max_thresh, min_spacing : values of each parameter to test
+    timestamps : timestamp of each signal, to also return bout durations
+    workers : number of (session, min_thresh) tasks processed in parallel
+    executor : 'thread' or 'process'
+
+    Output :
+    for every session a dictionary with the sorted parameter grids,
+    'count' : number of bouts, array of shape (min_thresh, max_thresh, min_spacing)
+    'bouts' : (start, end) indices as returned by bout_detect, keyed by
+              (min_thresh, max_thresh, min_spacing)
+    'peak' : maximum of each bout, same keys
+    'duration' : duration of each bout, same keys, only if timestamps are given
+    A single dictionary is returned if a single signal is given.
+    """
+    if executor == 'thread':
+        pool_type = concurrent.futures.ThreadPoolExecutor
+    elif executor == 'process':
+        pool_type = concurrent.futures.ProcessPoolExecutor
+    else:
+        raise ValueError("executor should be 'thread' or 'process'")
+
+    single = np.ndim(sessions[0]) == 0 if len(sessions) > 0 else True
+    if single:
+        sessions = [sessions]
+        timestamps = [timestamps]
+    elif timestamps is None:
+        timestamps = [None]*len(sessions)
+
+    min_thresh = np.unique(min_thresh)
+    max_thresh = np.unique(max_thresh)
+    min_spacing = np.unique(np.asarray(min_spacing, dtype=int))
+
+    with pool_type(max_workers=workers) as pool:
+        futures = [[pool.submit(_sweep_min_thresh, data,
+                                None if ts is None else np.asarray(ts),
+                                mt, max_thresh, min_spacing)
+                    for mt in min_thresh]
+                   for data, ts in zip(sessions, timestamps)]
+        sweeps = [_merge([f.result() for f in fs], min_thresh, max_thresh, min_spacing, ts)
+                  for fs, ts in zip(futures, timestamps)]
+
+    return sweeps[0] if single else sweeps
@@ -0,0 +1,319 @@
+import os
+import math
+import time
+import pickle
+import numpy as np
+
+from clam import bouts
+from clam.bouts import _bout_candidates, _pair_bouts, _bout_peaks
+
+
+def watch_state(path, motor, timestamp, flow=None, separator=',\n', min_thresh=0.05,
+                max_thresh=0.15, min_spacing=7, trial_duration=None, logic_level=5):
+    """
+    initial state for incrementally analysing a session that is still recording
+
+    Input :
+    path : folder of the session, as passed to load.load_raw_data
+    motor : name of the channel (file name without .txt) used for bout detection
+    timestamp : name of the timestamp channel
+    flow : name of the TTL channel marking flow on / off, for swim latencies
+    separator : separator between values, as in load.load_raw_data
+    min_thresh, max_thresh, min_spacing : as in bouts.bout_detect
+    trial_duration : as in bouts.swim_latency, trial numbers are nan if None
+    logic_level : as in utils.ttl_edges
+
+    Output :
+    dictionary holding the file offsets, the unprocessed samples and the
+    results so far. It can be saved with save_watch_state between updates
+    """
+    channels = [motor, timestamp] + ([flow] if flow is not None else [])
+
+    return {'path': path, 'separator': separator, 'channels': channels,
+            'motor': motor, 'timestamp': timestamp, 'flow': flow,
+            'min_thresh': min_thresh, 'max_thresh': max_thresh, 'min_spacing': min_spacing,
+            'trial_duration': trial_duration, 'logic_level': logic_level,
+            # bytes read so far and samples read but not yet processed
+            'offset': dict((c, 0) for c in channels),
+            'unread': dict((c, np.array([])) for c in channels),
+            # samples processed so far; tail holds those from index 'base' on
+            'n': 0, 'base': 0, 'tail_data': np.array([]), 'tail_time': np.array([]),
+            # next index to test for bout crossings and start of a running bout
+            'scan': 2, 'open_start': None, 'found': False, 'last_end_time': None,
+            'last_flow': 0., 'flows': [],
+            'bout_start': [], 'bout_end': [], 'duration': [], 'mean_velocity': [],
+            'max_velocity': [], 'ibi': [], 'latency': [], 'trial_number': [], 'lat_fst': []}
+
+
+def _read_appended(filename, offset, separator):
+    """
+    values appended to the file after 'offset' and the new offset
+
+    Line endings are normalised as in the text mode reading of
+    load.load_raw_data, so files written with '\r\n' parse the same way.
+    """
+
+    if not os.path.exists(filename):
+        return np.array([]), offset
+
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        raw = f.read()
+
+    # only parse up to the last complete value, the rest may still be written
+    separator = separator.replace('\r\n', '\n')
+    seps = set([separator.encode(), separator.replace('\n', '\r\n').encode()])
+    last = -1
+    for sep in seps:
+        k = raw.rfind(sep)
+        if k >= 0:
+            last = max(last, k+len(sep))
+    if last < 0:
+        return np.array([]), offset
+
+    raw = raw[:last]
+    text = raw.decode().replace('\r\n', '\n')
+    values = np.array(text.split(separator)[:-1], dtype=float)
+
+    return values, offset+len(raw)
+
+
+def update_watch(state):
+    """
+    parse newly appended samples and update bouts, bout metrics and latencies
+
+    Only samples present in every channel are processed, so the cost of an
+    update depends on the amount of new data and not on the session length.
+    The new results are computed first and written into the state only once
+    every step has succeeded, so a failed update can simply be retried.
+
+    Output :
+    number of new samples processed
+    """
+    offset, unread = {}, {}
+    for c in state['channels']:
+        values, offset[c] = _read_appended(state['path']+c+'.txt',
+                                           state['offset'][c], state['separator'])
+        unread[c] = np.concatenate((state['unread'][c], values))
+
+    nnew = min(len(unread[c]) for c in state['channels'])
+
+    new = {}
+    for c in state['channels']:
+        new[c] = unread[c][:nnew]
+        unread[c] = unread[c][nnew:]
+
+    if nnew == 0:
+        state['offset'], state['unread'] = offset, unread
+        return 0
+
+    first = state['n']
+    n = first+nnew
+    tail_data = np.concatenate((state['tail_data'], new[state['motor']]))
+    tail_time = np.concatenate((state['tail_time'], new[state['timestamp']]))
+
+    update = {'offset': offset, 'unread': unread, 'n': n}
+
+    if state['flow'] is not None:
+        update['flows'], update['last_flow'] = _new_flows(state, new[state['flow']], first, tail_time)
+
+    detected = _new_bouts(state, n, tail_data, tail_time)
+    for key in ('scan', 'open_start', 'found', 'last_end_time'):
+        update[key] = detected[key]
+
+    if state['flow'] is not None:
+        update['flows'], latencies = _new_latencies(state, update['flows'], detected, n, tail_time)
+    else:
+        latencies = {}
+
+    # keep only the samples that a later update can still look at
+    keep = min(update['scan'], n-1)
+    if update['open_start'] is not None:
+        keep = min(keep, update['open_start'])
+    update['tail_data'] = tail_data[keep-state['base']:]
+    update['tail_time'] = tail_time[keep-state['base']:]
+    update['base'] = keep
+
+    # nothing above has modified the state, commit the whole update at once
+    for new_results in (detected['metrics'], latencies):
+        for key in new_results:
+            state[key].extend(new_results[key])
+    state.update(update)
+
+    return nnew
+
+
+def _new_flows(state, signal, first, stamp):
+    """
+    flows after adding the new part of the flow channel, with edges found as
+    in utils.ttl_edges, and the last sample of the channel
+    """
+
+    signal = np.array(signal)
+    if state['logic_level'] == 1:
+        signal = signal*5
+    if first == 0:
+        signal[0] = 0
+
+    edges = np.diff(np.concatenate(([state['last_flow']], signal))).astype(int)
+
+    flows = [list(f) for f in state['flows']]
+
+    # edge k lies between samples first+k-1 and first+k, ttl_edges reports the first
+    for k in np.where((edges >= 1) | (edges <= -1))[0]:
+        t = stamp[first+k-1-state['base']]
+        if edges[k] >= 1:
+            flows.append([t, None])
+        elif len(flows) > 0 and flows[-1][1] is None:
+            flows[-1][1] = t
+
+    return flows, signal[-1]
+
+
+def _new_bouts(state, n, data, stamp):
+    """
+    extend bout detection over the new samples
+
+    Returns the new detection state, the start times of the new bouts and
+    their metrics, to be appended to the lists in the state.
+    """
+
+    ms = state['min_spacing']
+    base = state['base']
+    scan = state['scan']
+
+    detected = {'scan': scan, 'open_start': state['open_start'], 'found': state['found'],
+                'last_end_time': state['last_end_time'], 'start_time': np.array([]),
+                'metrics': {}}
+
+    if n-ms <= scan:
+        return detected
+
+    rises, falls = _bout_candidates(data[scan-base:], state['min_thresh'], ms)
+    start, end = _pair_bouts(rises+scan, falls+scan, state['open_start'])
+
+    detected['scan'] = n-ms
+    detected['open_start'] = None
+    if len(start) > len(end):
+        detected['open_start'] = start[-1]
+        start = start[:-1]
+
+    if len(end) > 0:
+        detected['found'] = True
+
+    # as in bout_detect a bout ending right at the scan limit is not yet
+    # final; rescan its end once more samples are available
+    if len(end) > 0 and end[-1] == n-ms:
+        detected['open_start'] = start[-1]
+        detected['scan'] = end[-1]-1
+        start = start[:-1]
+        end = end[:-1]
+
+    peaks = _bout_peaks(data, start-base, end-base)
+    passed = peaks > state['max_thresh']
+    start = start[passed]
+    end = end[passed]
+
+    if len(start) == 0:
+        return detected
+
+    rel = (start-base, end-base)
+    duration = bouts.bout_duration(rel, stamp)
+
+    ibi = bouts.inter_bout_interval(rel, stamp)
+    if state['last_end_time'] is not None:
+        ibi = [stamp[rel[0][0]]-state['last_end_time']] + ibi
+
+    detected['last_end_time'] = stamp[rel[1][-1]]
+    detected['start_time'] = stamp[rel[0]]
+    detected['metrics'] = {'bout_start': start.tolist(), 'bout_end': end.tolist(),
+                           'duration': duration,
+                           'mean_velocity': bouts.mean_bout_velocity(data, rel, stamp, duration),
+                           'max_velocity': bouts.max_bout_velocity(data, rel),
+                           'ibi': ibi}
+
+    return detected
+
+
+def _new_latencies(state, flows, detected, n, stamp):
+    """
+    resolve the flows that a new bout starts in, or that can no longer get one
+
+    Returns the flows still pending and the new latencies, trial numbers and
+    flow start times, as in bouts.swim_latency
+    """
+
+    open_start = detected['open_start']
+    frontier = detected['scan'] if open_start is None else min(detected['scan'], open_start)
+    if frontier < n:
+        frontier_time = stamp[frontier-state['base']]
+    else:
+        frontier_time = -np.inf
+
+    new_start_time = detected['start_time']
+    latency, trial_number, lat_fst = [], [], []
+    pending = []
+    for fs, fe in flows:
+        s = np.where(new_start_time >= fs)[0]
+        if len(s) != 0:
+            s = new_start_time[s[0]]
+            if fe is None or s <= fe:
+                latency.append(s-fs)
+                if state['trial_duration'] is None:
+                    trial_number.append(float('nan'))
+                else:
+                    trial_number.append(math.floor(s/state['trial_duration']))
+                lat_fst.append(fs)
+        elif fe is None or frontier_time <= fe:
+            pending.append([fs, fe])
+
+    return pending, {'latency': latency, 'trial_number': trial_number, 'lat_fst': lat_fst}
+
+
+def watch_bouts(state):
+    """bout start and end indices so far, in the same form as bouts.bout_detect"""
+
+    if not state['found']:
+        return(np.array([0]), np.array([0]))
+
+    return(np.array(state['bout_start'], dtype=int), np.array(state['bout_end'], dtype=int))
+
+
+def save_watch_state(state, filename):
+
+    with open(filename, 'wb') as f:
+        pickle.dump(state, f)
+
+
+def load_watch_state(filename):
+
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def watch_session(state, interval=60, callback=None, max_updates=None, state_file=None):
+    """
+    poll the session files and update the analysis whenever data is appended
+
+    Input :
+    state : as returned by watch_state or load_watch_state
+    interval : seconds between polls
+    callback : function called with the state after every update with new data
+    max_updates : number of polls, runs until interrupted if None
+    state_file : if given, the state is saved there after every update
+    """
+    polls = 0
+    while max_updates is None or polls < max_updates:
+
+        if polls > 0:
+            time.sleep(interval)
+
+        if update_watch(state) > 0:
+            if state_file is not None:
+                save_watch_state(state, state_file)
+            if callback is not None:
+                callback(state)
+
+        polls += 1
+
+    return state